@@ -1,31 +1,59 @@
 """Telegram File Converter Bot."""
 
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
 import logging
 import os
+import signal
+from pathlib import Path
+from typing import List, Optional, Union
 from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Bot, File, InputMediaDocument, Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
+    AIORateLimiter,
     Application, 
     CommandHandler, 
     MessageHandler, 
     filters, 
     ContextTypes, 
-    ConversationHandler
+    ConversationHandler,
+    PicklePersistence
 )
 
 from config.messages import MESSAGES
-from config.keyboards import get_conversion_keyboard
-from config.formats import SUPPORTED_FORMATS, import_converter
+from config.keyboards import (
+    get_conversion_keyboard,
+    get_multi_selection_keyboard,
+    CONVERT_ALL_BUTTON,
+    CHOOSE_SEVERAL_BUTTON,
+    CONVERT_SELECTED_BUTTON
+)
+from config.formats import SUPPORTED_FORMATS, BATCH_FORMATS
 from utils import (
     get_file_info, 
     normalize_file_extension, 
     format_file_info,
+    format_size,
     extract_format_from_button, 
-    cleanup_files,
+    fetch_file,
+    read_file_head,
     ConversionError,
     FileSizeError,
-    UnsupportedFormatError
+    UnsupportedFormatError,
+    JobCancelledError,
+    JobInterruptedError,
+    JobLimitError,
+    BatchLimitError
 )
+from utils.batch import convert_archive
+from utils.profiling import describe_profile
+from utils.progress import ProgressReporter
+from utils.sniffing import SNIFF_SIZE, detect_format, formats_match
+from utils.worker import ConversionJob, WorkerPool
+
+IMPORT_TIME = time.perf_counter() - _IMPORT_STARTED
 
 # Load environment variables
 load_dotenv()
@@ -37,13 +65,54 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Bot API server. A self-hosted server in local mode lifts the cloud
+# download/upload limits and gives direct access to the files on disk.
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL')  # e.g. http://localhost:8081/bot
+BOT_API_FILE_URL = os.getenv('BOT_API_FILE_URL')  # e.g. http://localhost:8081/file/bot
+BOT_API_LOCAL_MODE = os.getenv('BOT_API_LOCAL_MODE', 'false').lower() in ('1', 'true', 'yes')
+
 # Bot configuration
-MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB in bytes
-MAX_OUTPUT_SIZE = 50 * 1024 * 1024  # 50MB in bytes
+MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE_MB', '2000' if BOT_API_LOCAL_MODE else '20')) * 1024 * 1024
+MAX_OUTPUT_SIZE = int(os.getenv('MAX_OUTPUT_SIZE_MB', '2000' if BOT_API_LOCAL_MODE else '50')) * 1024 * 1024
 TEMP_DIR = os.path.join(os.getcwd(), 'temp')
+PERSISTENCE_FILE = os.getenv('PERSISTENCE_FILE', os.path.join(os.getcwd(), 'bot_state.pickle'))
+DRAIN_TIMEOUT = int(os.getenv('DRAIN_TIMEOUT', '60'))  # seconds to finish running jobs on shutdown
+
+# Import time budget for the bot process, which only needs to poll
+IMPORT_BUDGET = float(os.getenv('IMPORT_BUDGET_MS', '1000')) / 1000
+
+# Worker limits, so that one bad file cannot take down the bot
+MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', os.cpu_count() or 2))
+JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', '300'))  # wall-clock seconds per job
+JOB_CPU_LIMIT = int(os.getenv('JOB_CPU_LIMIT', '240'))  # CPU seconds per job
+JOB_MEMORY_LIMIT = int(os.getenv('JOB_MEMORY_LIMIT_MB', '1024')) * 1024 * 1024
+
+# Zip batches: limits on the archive contents, checked before extracting
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '500'))
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE_MB', '500')) * 1024 * 1024
+
+# Profiling: jobs slower than PROFILE_SLOW_SECONDS (0 to disable) keep a
+# stack profile, the most recent PROFILE_RING_SIZE of them are kept for /profile
+ADMIN_IDS = [int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()]
+PROFILE_SLOW_SECONDS = float(os.getenv('PROFILE_SLOW_SECONDS', '30'))
+PROFILE_RING_SIZE = int(os.getenv('PROFILE_RING_SIZE', '20'))
+
+worker_pool = WorkerPool(
+    temp_dir=TEMP_DIR,
+    max_jobs=MAX_CONCURRENT_JOBS,
+    timeout=JOB_TIMEOUT,
+    memory_limit=JOB_MEMORY_LIMIT,
+    cpu_limit=JOB_CPU_LIMIT,
+    max_output_size=MAX_OUTPUT_SIZE,
+    profile_threshold=PROFILE_SLOW_SECONDS,
+    profile_ring_size=PROFILE_RING_SIZE
+)
+
+# Task that resumes the jobs interrupted by the previous shutdown
+resume_task: Optional[asyncio.Task] = None
 
 # Conversation states
-UPLOAD, FORMAT_SELECTION = range(2)
+UPLOAD, FORMAT_SELECTION, MULTI_SELECTION = range(3)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
@@ -51,30 +120,118 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
-    await update.message.reply_text(MESSAGES['help'])
+    await update.message.reply_text(MESSAGES['help'].format(max_size=format_size(MAX_FILE_SIZE)))
+
+async def auto_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Manage the auto-convert preferences of the chat. /auto lists them,
+    /auto <from> <to> converts every <from> file to <to> without asking,
+    /auto <from> off removes one and /auto off removes all of them.
+    """
+    preferences = context.chat_data.setdefault('auto_convert', {})
+    args = [normalize_file_extension(f'file.{arg.lstrip(".")}') for arg in context.args or []]
+    
+    if not args:
+        if not preferences:
+            await update.message.reply_text(MESSAGES['auto_none'])
+            return
+        lines = [f'• {source.upper()} → {target.upper()}' for source, target in sorted(preferences.items())]
+        await update.message.reply_text(MESSAGES['auto_list'].format(preferences='\n'.join(lines)))
+    elif args == ['off']:
+        preferences.clear()
+        await update.message.reply_text(MESSAGES['auto_cleared'])
+    elif len(args) == 2 and args[1] == 'off':
+        preferences.pop(args[0], None)
+        await update.message.reply_text(MESSAGES['auto_removed'].format(input_format=args[0].upper()))
+    elif len(args) == 2 and args[1] in SUPPORTED_FORMATS.get(args[0], []):
+        preferences[args[0]] = args[1]
+        await update.message.reply_text(
+            MESSAGES['auto_saved'].format(input_format=args[0].upper(), output_format=args[1].upper())
+        )
+    else:
+        await update.message.reply_text(MESSAGES['auto_usage'])
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Cancel the running conversion, or the pending format selection."""
+    if worker_pool.cancel(update.effective_chat.id, update.effective_user.id):
+        await update.message.reply_text(MESSAGES['cancelling'])
+    elif context.user_data.get('file_id'):
+        context.user_data.clear()
+        await update.message.reply_text(MESSAGES['cancelled'], reply_markup=ReplyKeyboardRemove())
+    else:
+        await update.message.reply_text(MESSAGES['nothing_to_cancel'], reply_markup=ReplyKeyboardRemove())
+    return ConversationHandler.END
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Admin only. /profile lists the captured profiles, /profile <n> sends one
+    as folded stacks and /profile on|off toggles profiling of every job.
+    """
+    arg = context.args[0].lower() if context.args else ''
+    
+    if arg in ('on', 'off'):
+        worker_pool.profile_all = arg == 'on'
+        await update.message.reply_text(MESSAGES[f'profiling_{arg}'])
+        return
+    
+    profiles = list(worker_pool.profiles)
+    if not arg:
+        if not profiles:
+            await update.message.reply_text(MESSAGES['no_profiles'])
+            return
+        lines = [f'{index}. {describe_profile(profile)}' for index, profile in enumerate(profiles, 1)]
+        await update.message.reply_text(MESSAGES['profile_list'].format(profiles='\n'.join(lines)))
+        return
+    
+    if not arg.isdigit() or not 1 <= int(arg) <= len(profiles):
+        await update.message.reply_text(MESSAGES['profile_usage'])
+        return
+    
+    profile = profiles[int(arg) - 1]
+    await update.message.reply_document(
+        document=profile['folded'].encode(),
+        filename=f"profile-{time.strftime('%Y%m%d-%H%M%S', time.localtime(profile['finished']))}.folded",
+        caption=describe_profile(profile)
+    )
 
-async def handle_conversion_error(update: Update, error: Exception) -> None:
+async def handle_conversion_error(bot: Bot, chat_id: int, error: Exception) -> None:
     """Handle conversion errors and send appropriate messages."""
     error_msg = str(error).lower()
     
-    if isinstance(error, FileSizeError) or "too large" in error_msg:
-        await update.message.reply_text(
-            '⚠️ The converted file is too large to send via Telegram (>50MB).\n'
+    if isinstance(error, JobCancelledError):
+        await bot.send_message(chat_id, MESSAGES['cancelled'], reply_markup=ReplyKeyboardRemove())
+        return
+    elif isinstance(error, JobLimitError):
+        await bot.send_message(chat_id, MESSAGES['job_limit'])
+    elif isinstance(error, BatchLimitError):
+        await bot.send_message(
+            chat_id,
+            MESSAGES['batch_too_large'].format(
+                max_files=BATCH_MAX_FILES,
+                max_size=format_size(BATCH_MAX_SIZE)
+            )
+        )
+    elif isinstance(error, FileSizeError) or "too large" in error_msg:
+        await bot.send_message(
+            chat_id,
+            f'⚠️ The converted file is too large to send via Telegram (>{format_size(MAX_OUTPUT_SIZE)}).\n'
             'Please try with a smaller file or use a different format.'
         )
     elif isinstance(error, UnsupportedFormatError) or isinstance(error, ImportError):
-        await update.message.reply_text(
+        await bot.send_message(
+            chat_id,
             '❌ Sorry, this conversion is not supported.\n'
             'Please try a different format.'
         )
     elif isinstance(error, ConversionError):
-        await update.message.reply_text(
+        await bot.send_message(
+            chat_id,
             '❌ Sorry, there was an error converting your file.\n'
             'The file might be corrupted or in an unsupported format.\n'
             'Please try again with a different file.'
         )
     else:
-        await update.message.reply_text(MESSAGES['error_generic'])
+        await bot.send_message(chat_id, MESSAGES['error_generic'])
     
     logger.error(f"Conversion error: {str(error)}")
 
@@ -98,14 +255,50 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
         # Validate file size
         if file_size > MAX_FILE_SIZE:
-            await update.message.reply_text(MESSAGES['file_too_large'])
+            await update.message.reply_text(
+                MESSAGES['file_too_large'].format(max_size=format_size(MAX_FILE_SIZE))
+            )
             return ConversationHandler.END
 
+        # Check what the file really is from its first bytes, before it is
+        # downloaded or takes a worker slot. Photos are always JPEG.
+        if not file_info['is_photo']:
+            head = await read_file_head(file, SNIFF_SIZE)
+            detected = detect_format(head) if head is not None else file_ext
+            if not formats_match(file_ext, detected):
+                if detected not in SUPPORTED_FORMATS:
+                    message = 'format_mismatch' if detected else 'format_unknown'
+                    await update.message.reply_text(
+                        MESSAGES[message].format(claimed=file_ext.upper(), actual=str(detected).upper())
+                    )
+                    return ConversationHandler.END
+                
+                # A supported format with the wrong name: convert it as what it is
+                context.user_data['file_name'] = f"{os.path.splitext(file_info['file_name'])[0]}.{detected}"
+                await update.message.reply_text(
+                    MESSAGES['format_detected'].format(claimed=file_ext.upper(), actual=detected.upper())
+                )
+                file_ext = detected
+
         # Validate file format
         if not file_info['is_photo'] and file_ext not in SUPPORTED_FORMATS:
             await update.message.reply_text(MESSAGES['unsupported_format'])
             return ConversationHandler.END
 
+        # Convert right away if the chat always converts this format the same way
+        auto_format = context.chat_data.get('auto_convert', {}).get(file_ext)
+        if auto_format:
+            await update.message.reply_text(
+                MESSAGES['auto_converting'].format(
+                    input_format=file_ext.upper(),
+                    output_format=auto_format.upper(),
+                    command=f'/auto {file_ext} off'
+                ),
+                reply_markup=ReplyKeyboardRemove()
+            )
+            start_conversion(update, context, get_stored_file_info(context), [auto_format], file=file)
+            return ConversationHandler.END
+
         # Show conversion options
         keyboard = get_conversion_keyboard(file_ext, file_info['is_photo'])
         reply_markup = ReplyKeyboardMarkup(
@@ -124,117 +317,351 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
 async def convert_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Convert the file to the selected format."""
-    output_path = None
-    input_path = None
-    progress_message = None
-    
     try:
         selected_format = extract_format_from_button(update.message.text)
         
         if selected_format == 'cancel':
-            await update.message.reply_text(
-                '❌ Operation cancelled.\nSend me a new file when you\'re ready!',
-                reply_markup=ReplyKeyboardRemove()
-            )
+            await update.message.reply_text(MESSAGES['cancelled'], reply_markup=ReplyKeyboardRemove())
             return ConversationHandler.END
 
-        try:
-            progress_message = await update.message.reply_text('📥 Downloading file...\nPlease wait.')
-            
-            # Setup and download
-            file = await context.bot.get_file(context.user_data['file_id'])
-            os.makedirs(TEMP_DIR, exist_ok=True)
-            input_path = os.path.join(TEMP_DIR, context.user_data['file_name'])
-            await file.download_to_drive(input_path)
-            
-            await progress_message.edit_text('🔄 Converting your file...\nThis might take a moment.')
-            
-            # Convert file
-            input_format = normalize_file_extension(context.user_data['file_name'])
-            original_filename = os.path.splitext(context.user_data['file_name'])[0]
-            
-            converter = import_converter(input_format, selected_format)
-            if not converter:
-                raise UnsupportedFormatError("Conversion not supported")
-            
-            output_path = (converter(input_path, selected_format) 
-                         if selected_format in ['jpg', 'png'] 
-                         else converter(input_path))
-            
-            if not output_path or not os.path.exists(output_path):
-                raise ConversionError("Conversion failed")
-            
-            if os.path.getsize(output_path) > MAX_OUTPUT_SIZE:
-                raise FileSizeError("Output file too large")
-            
-            # Send converted file
-            await progress_message.edit_text('📤 Sending converted file...\nAlmost done!')
-            
-            new_filename = f"{original_filename}.{selected_format}"
-            with open(output_path, 'rb') as f:
-                await update.message.reply_document(
-                    document=f,
-                    filename=new_filename,
-                    caption='✅ Here\'s your converted file!',
-                    read_timeout=120,
-                    write_timeout=120,
-                    connect_timeout=60,
-                    pool_timeout=60
-                )
-            
-            await progress_message.delete()
-            await update.message.reply_text(
-                '✨ Send me another file to convert!',
-                reply_markup=ReplyKeyboardRemove()
-            )
-            return ConversationHandler.END
-            
-        except Exception as e:
-            await handle_conversion_error(update, e)
-            return ConversationHandler.END
+        start_conversion(update, context, get_stored_file_info(context), [selected_format])
+        return ConversationHandler.END
 
     except Exception as e:
         logger.error(f"Error in convert_file: {str(e)}")
         await update.message.reply_text(MESSAGES['error_generic'])
         return ConversationHandler.END
+
+async def convert_all(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Convert the file to every format it supports."""
+    file_info = get_stored_file_info(context)
+    formats = SUPPORTED_FORMATS.get(normalize_file_extension(file_info['file_name']), [])
+    start_conversion(update, context, file_info, formats)
+    return ConversationHandler.END
+
+async def choose_several(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Let the user pick several target formats."""
+    context.user_data['selected_formats'] = []
+    keyboard = get_multi_selection_keyboard(
+        normalize_file_extension(context.user_data['file_name']),
+        context.user_data['is_photo']
+    )
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True, selective=True)
+    await update.message.reply_text(MESSAGES['choose_several'], reply_markup=reply_markup)
+    return MULTI_SELECTION
+
+async def toggle_format(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Add a format to, or remove it from, the selection."""
+    selected_format = extract_format_from_button(update.message.text)
+    selected = context.user_data.setdefault('selected_formats', [])
+    if selected_format in selected:
+        selected.remove(selected_format)
+    else:
+        selected.append(selected_format)
+    await update.message.reply_text(
+        MESSAGES['selected_formats'].format(formats=', '.join(f.upper() for f in selected) or '-')
+    )
+    return MULTI_SELECTION
+
+async def convert_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Convert the file to all selected formats."""
+    selected = context.user_data.get('selected_formats', [])
+    if not selected:
+        await update.message.reply_text(MESSAGES['nothing_selected'])
+        return MULTI_SELECTION
+    start_conversion(update, context, get_stored_file_info(context), list(selected))
+    return ConversationHandler.END
+
+def start_conversion(update: Update, context: ContextTypes.DEFAULT_TYPE, file_info: dict,
+                     formats: List[str], file: Optional[File] = None) -> None:
+    """
+    Run a conversion in the background. The conversation ends right away,
+    so files sent meanwhile are handled instead of waiting for it.
+    """
+    context.application.create_task(
+        run_conversion(context.application, update.effective_chat.id, file_info, formats,
+                       file=file, user_id=update.effective_user.id),
+        update=update
+    )
+
+def get_stored_file_info(context: ContextTypes.DEFAULT_TYPE) -> dict:
+    """Get the information about the uploaded file from the user data."""
+    return {key: context.user_data[key] for key in ('is_photo', 'file_id', 'file_name')}
+
+def document_input(bot: Bot, path: str) -> Union[Path, bytes]:
+    """Input for sending a file: by path to a local server, else by upload."""
+    return Path(path) if bot.local_mode else Path(path).read_bytes()
+
+async def run_conversion(application: Application, chat_id: int, file_info: dict,
+                         formats: List[str], file: Optional[File] = None,
+                         user_id: Optional[int] = None) -> None:
+    """
+    Download, convert and send a file, reporting any errors to the chat.
+    A File that was just fetched for file_info can be passed to skip fetching it again.
+    user_id is the user who started the conversion, who can cancel it.
+    """
+    bot = application.bot
+    try:
+        with worker_pool.job(chat_id, user_id) as job:
+            async with ProgressReporter(bot, chat_id) as progress:
+                progress.update('📥 Downloading file...\nPlease wait.')
+                
+                # Setup and download
+                if file is None:
+                    file = await bot.get_file(file_info['file_id'])
+                input_path = job.path_for(file_info['file_name'])
+                await fetch_file(file, input_path)
+                
+                progress.update('🔄 Converting your file...\nThis might take a moment.')
+                
+                # Convert file in a worker process. Several formats share one
+                # download and one decode of the input.
+                input_format = normalize_file_extension(file_info['file_name'])
+                original_filename = os.path.splitext(file_info['file_name'])[0]
+                
+                if input_format in BATCH_FORMATS:
+                    await send_batch(bot, chat_id, job, progress, input_path,
+                                     original_filename, formats[0])
+                    return
+                
+                if len(formats) == 1:
+                    results = {formats[0]: await job.run(input_format, formats[0], input_path)}
+                else:
+                    results = await job.run_many(input_format, formats, input_path)
+                
+                outputs, errors = {}, {}
+                for output_format, result in results.items():
+                    if isinstance(result, Exception):
+                        errors[output_format] = result
+                    elif not result or not os.path.exists(result):
+                        errors[output_format] = ConversionError("Conversion failed")
+                    elif os.path.getsize(result) > MAX_OUTPUT_SIZE:
+                        errors[output_format] = FileSizeError("Output file too large")
+                    else:
+                        outputs[output_format] = result
+                
+                if not outputs:
+                    raise next(iter(errors.values()))
+                
+                # Send converted files
+                progress.update('📤 Sending converted file...\nAlmost done!')
+                
+                caption = MESSAGES['conversion_done']
+                if errors:
+                    failed = ', '.join(f.upper() for f in errors)
+                    caption = MESSAGES['conversion_partial'].format(formats=failed) + '\n' + caption
+                    logger.error(f"Conversion errors: {errors}")
+                
+                timeouts = dict(read_timeout=120, write_timeout=120, connect_timeout=60, pool_timeout=60)
+                if len(outputs) == 1:
+                    output_format, output_path = next(iter(outputs.items()))
+                    # In local mode the server reads the file straight from disk
+                    await bot.send_document(
+                        chat_id,
+                        document=Path(output_path),
+                        filename=f"{original_filename}.{output_format}",
+                        caption=caption,
+                        reply_markup=ReplyKeyboardRemove(),
+                        **timeouts
+                    )
+                    return
+                
+                # Several files go out together as one album
+                await bot.send_media_group(
+                    chat_id,
+                    [
+                        InputMediaDocument(
+                            document_input(bot, output_path),
+                            filename=f"{original_filename}.{output_format}"
+                        )
+                        for output_format, output_path in outputs.items()
+                    ],
+                    **timeouts
+                )
+                await bot.send_message(chat_id, caption, reply_markup=ReplyKeyboardRemove())
         
-    finally:
-        await cleanup_files(input_path, output_path)
-        if progress_message:
-            try:
-                await progress_message.delete()
-            except:
-                pass
+    except JobInterruptedError:
+        # Checkpoint the job so that it is resumed after the restart
+        application.bot_data.setdefault('interrupted_jobs', []).append({
+            'chat_id': chat_id,
+            'user_id': user_id,
+            'file_info': file_info,
+            'formats': formats
+        })
+        await bot.send_message(chat_id, MESSAGES['job_interrupted'])
+    except Exception as e:
+        await handle_conversion_error(bot, chat_id, e)
+
+async def send_batch(bot: Bot, chat_id: int, job: ConversionJob, progress: ProgressReporter,
+                     archive_path: str, original_filename: str, output_format: str) -> None:
+    """Convert every file of a zip archive and send the results as one archive."""
+    output_path = job.path_for(f"{original_filename}-{output_format}.zip")
+    converted, errors = await convert_archive(
+        job, archive_path, output_format, output_path,
+        max_files=BATCH_MAX_FILES,
+        max_size=BATCH_MAX_SIZE,
+        on_progress=lambda done, total: progress.update(f'🔄 Converting files... {done}/{total}')
+    )
+    if not converted:
+        raise ConversionError("No file in the archive could be converted")
+    if os.path.getsize(output_path) > MAX_OUTPUT_SIZE:
+        raise FileSizeError("Output file too large")
+    
+    progress.update('📤 Sending converted files...\nAlmost done!')
+    caption = MESSAGES['batch_done'].format(
+        converted=converted,
+        total=converted + len(errors),
+        format=output_format.upper()
+    )
+    if errors:
+        caption = MESSAGES['batch_failed'].format(failed=len(errors)) + '\n' + caption
+    
+    await bot.send_document(
+        chat_id,
+        document=Path(output_path),
+        filename=os.path.basename(output_path),
+        caption=caption,
+        reply_markup=ReplyKeyboardRemove(),
+        read_timeout=120,
+        write_timeout=120,
+        connect_timeout=60,
+        pool_timeout=60
+    )
+
+async def resume_interrupted_jobs(application: Application) -> None:
+    """
+    Restart the jobs that were interrupted by the previous shutdown.
+
+    Waits until the application is running: only tasks created from then on
+    are awaited by Application.stop(), so that a job interrupted again is
+    checkpointed before the persistence is flushed.
+    """
+    while not application.running:
+        await asyncio.sleep(0.1)
+    jobs = application.bot_data.pop('interrupted_jobs', [])
+    for job in jobs:
+        application.create_task(
+            run_conversion(application, job['chat_id'], job['file_info'], job['formats'],
+                           user_id=job.get('user_id'))
+        )
+    if jobs:
+        logger.info(f"Resuming {len(jobs)} interrupted conversion(s)")
+
+async def drain_and_stop(application: Application) -> None:
+    """Stop taking updates, let running jobs finish, then stop the bot."""
+    logger.info(f"Shutting down, waiting up to {DRAIN_TIMEOUT}s for running conversions...")
+    # Updates that arrive from now on stay with Telegram for the next instance
+    if application.updater.running:
+        await application.updater.stop()
+    interrupted = await worker_pool.drain(DRAIN_TIMEOUT)
+    if interrupted:
+        logger.warning(f"Interrupted {interrupted} conversion(s), they resume after the restart")
+    application.stop_running()
+
+def request_shutdown(application: Application) -> None:
+    """Handle a stop signal. A second signal stops the bot right away."""
+    if worker_pool.draining:
+        logger.warning("Stopping without waiting for running conversions")
+        worker_pool.interrupt_all()
+        application.stop_running()
+        return
+    worker_pool.draining = True
+    application.create_task(drain_and_stop(application))
+
+async def post_init(application: Application) -> None:
+    """Install the graceful shutdown handlers and resume interrupted jobs."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_shutdown, application)
+        except NotImplementedError:
+            # Windows: Ctrl+C still stops the bot, just without draining
+            pass
+    # post_init runs before the application is started
+    global resume_task
+    resume_task = loop.create_task(resume_interrupted_jobs(application))
 
 def setup_handlers(application: Application) -> None:
     """Set up all handlers for the application."""
+    format_buttons = filters.Regex(
+        '^(📄 Convert to PDF 📱|📄 Convert to PDF 📊|'
+        '🖼️ Convert to JPG 🎨|🖼️ Convert to PNG 🎨|'
+        '🖼️ Convert to WEBP 🎨|🖼️ Convert to AVIF 🎨|'
+        '📊 Convert to XLSX 📈|📊 Convert to CSV 📉)$'
+    )
+    cancel_button = filters.Regex('^❌ Cancel ↩️$')
+
     conv_handler = ConversationHandler(
         entry_points=[MessageHandler(filters.Document.ALL | filters.PHOTO, handle_file)],
         states={
             FORMAT_SELECTION: [
                 MessageHandler(
-                    filters.Regex('^(📄 Convert to PDF 📱|📄 Convert to PDF 📊|'
-                                '🖼️ Convert to JPG 🎨|🖼️ Convert to PNG 🎨|'
-                                '📊 Convert to XLSX 📈|📊 Convert to CSV 📉|'
-                                '❌ Cancel ↩️|Convert another file 📤)$'),
+                    format_buttons | cancel_button | filters.Regex('^Convert another file 📤$'),
                     convert_file
-                )
+                ),
+                MessageHandler(filters.Regex(f'^{CONVERT_ALL_BUTTON}$'), convert_all),
+                MessageHandler(filters.Regex(f'^{CHOOSE_SEVERAL_BUTTON}$'), choose_several)
+            ],
+            MULTI_SELECTION: [
+                MessageHandler(format_buttons, toggle_format),
+                MessageHandler(filters.Regex(f'^{CONVERT_SELECTED_BUTTON}$'), convert_selected),
+                MessageHandler(cancel_button, cancel_command)
             ],
         },
-        fallbacks=[],
+        fallbacks=[CommandHandler("cancel", cancel_command)],
+        name='conversion',
+        persistent=True,
     )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("auto", auto_command))
+    if ADMIN_IDS:
+        application.add_handler(
+            CommandHandler("profile", profile_command, filters=filters.User(user_id=ADMIN_IDS))
+        )
     application.add_handler(conv_handler)
+    # Conversions run after their conversation has ended, so they are cancelled from here
+    application.add_handler(CommandHandler("cancel", cancel_command))
+    application.add_handler(MessageHandler(cancel_button, cancel_command))
+
+def report_startup() -> None:
+    """Start the worker fork server and log startup and import timings."""
+    logger.info(f"Imported bot modules in {IMPORT_TIME * 1000:.0f} ms")
+    if IMPORT_TIME > IMPORT_BUDGET:
+        logger.warning(f"Import time exceeds the budget of {IMPORT_BUDGET * 1000:.0f} ms")
+
+    heavy_modules = worker_pool.heavy_modules_loaded()
+    if heavy_modules:
+        logger.warning(f"Bot process imported worker-only modules: {', '.join(heavy_modules)}")
+
+    warm_up_time = worker_pool.start()
+    logger.info(f"Conversion workers ready in {warm_up_time * 1000:.0f} ms")
 
 def main() -> None:
     """Start the bot."""
     try:
-        application = Application.builder().token(os.getenv('BOT_TOKEN')).build()
+        builder = (
+            Application.builder()
+            .token(os.getenv('BOT_TOKEN'))
+            # Shared outbound scheduler: respects Telegram's rate limits and
+            # waits out 429 flood control instead of failing the request
+            .rate_limiter(AIORateLimiter(max_retries=3))
+            .local_mode(BOT_API_LOCAL_MODE)
+            # Keeps conversations and user data across restarts
+            .persistence(PicklePersistence(filepath=PERSISTENCE_FILE))
+            .post_init(post_init)
+        )
+        if BOT_API_BASE_URL:
+            builder.base_url(BOT_API_BASE_URL)
+        if BOT_API_FILE_URL:
+            builder.base_file_url(BOT_API_FILE_URL)
+        application = builder.build()
         setup_handlers(application)
+        report_startup()
         logger.info("Starting bot...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        # Stop signals are handled by post_init to drain running jobs first
+        application.run_polling(allowed_updates=Update.ALL_TYPES, stop_signals=None)
     except Exception as e:
         logger.error(f"Failed to start bot: {str(e)}")
         raise
@@ -10,13 +10,21 @@ ConverterFunction = Callable[[str, Optional[str]], str]
 
 # Supported formats
 SUPPORTED_FORMATS: Dict[str, List[str]] = {
-    'jpg': ['pdf', 'png'],
-    'jpeg': ['pdf', 'png'],
-    'png': ['pdf', 'jpg'],
+    'jpg': ['pdf', 'png', 'webp', 'avif'],
+    'jpeg': ['pdf', 'png', 'webp', 'avif'],
+    'png': ['pdf', 'jpg', 'webp', 'avif'],
     'csv': ['xlsx', 'pdf'],
-    'xlsx': ['csv']
+    'xlsx': ['csv'],
+    # Zip archives are converted file by file, see utils/batch.py
+    'zip': ['pdf', 'xlsx', 'csv', 'jpg', 'png', 'webp', 'avif']
 }
 
+# Archive formats whose files are converted as a batch
+BATCH_FORMATS: List[str] = ['zip']
+
+# Image formats whose converter also takes the target format
+IMAGE_OUTPUT_FORMATS: List[str] = ['jpg', 'png', 'webp', 'avif']
+
 def import_converter(from_format: str, to_format: str) -> Optional[ConverterFunction]:
     """Import the appropriate converter based on formats."""
     try:
@@ -24,7 +32,7 @@ def import_converter(from_format: str, to_format: str) -> Optional[ConverterFunc
             if to_format == 'pdf':
                 from converters.image_to_pdf import convert_image_to_pdf
                 return convert_image_to_pdf
-            elif to_format in ['jpg', 'png']:
+            elif to_format in IMAGE_OUTPUT_FORMATS:
                 from converters.image_converter import convert_image
                 return convert_image
         elif from_format == 'csv':
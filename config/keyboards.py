@@ -1,20 +1,23 @@
 """Keyboard configurations for the bot."""
 
 from telegram import KeyboardButton
-from config.formats import SUPPORTED_FORMATS
+from config.formats import SUPPORTED_FORMATS, BATCH_FORMATS
 
 KEYBOARD_LAYOUTS = {
     'jpg': [
         [KeyboardButton('📄 Convert to PDF 📱')],
-        [KeyboardButton('🖼️ Convert to PNG 🎨')]
+        [KeyboardButton('🖼️ Convert to PNG 🎨')],
+        [KeyboardButton('🖼️ Convert to WEBP 🎨'), KeyboardButton('🖼️ Convert to AVIF 🎨')]
     ],
     'jpeg': [
         [KeyboardButton('📄 Convert to PDF 📱')],
-        [KeyboardButton('🖼️ Convert to PNG 🎨')]
+        [KeyboardButton('🖼️ Convert to PNG 🎨')],
+        [KeyboardButton('🖼️ Convert to WEBP 🎨'), KeyboardButton('🖼️ Convert to AVIF 🎨')]
     ],
     'png': [
         [KeyboardButton('📄 Convert to PDF 📱')],
-        [KeyboardButton('🖼️ Convert to JPG 🎨')]
+        [KeyboardButton('🖼️ Convert to JPG 🎨')],
+        [KeyboardButton('🖼️ Convert to WEBP 🎨'), KeyboardButton('🖼️ Convert to AVIF 🎨')]
     ],
     'csv': [
         [KeyboardButton('📄 Convert to PDF 📊')],
@@ -27,13 +30,19 @@ KEYBOARD_LAYOUTS = {
 
 CANCEL_BUTTON = [KeyboardButton('❌ Cancel ↩️')]
 
-def get_conversion_keyboard(file_ext, is_photo=False):
-    """Get the appropriate keyboard layout for file conversion."""
+# Buttons for converting one upload to several formats
+CONVERT_ALL_BUTTON = '📦 Convert to all formats 📦'
+CHOOSE_SEVERAL_BUTTON = '☑️ Choose several ☑️'
+CONVERT_SELECTED_BUTTON = '✅ Convert selected ✅'
+
+def get_format_rows(file_ext, is_photo=False):
+    """Get the keyboard rows with one button per target format."""
     keyboard = []
     
     if is_photo:
         keyboard = [
             ['🖼️ Convert to JPG 🎨', '🖼️ Convert to PNG 🎨'],
+            ['🖼️ Convert to WEBP 🎨', '🖼️ Convert to AVIF 🎨'],
             ['📄 Convert to PDF 📱']
         ]
     else:
@@ -49,8 +58,28 @@ def get_conversion_keyboard(file_ext, is_photo=False):
             keyboard.append(['🖼️ Convert to JPG 🎨'])
         if 'png' in formats:
             keyboard.append(['🖼️ Convert to PNG 🎨'])
+        if 'webp' in formats and 'avif' in formats:
+            keyboard.append(['🖼️ Convert to WEBP 🎨', '🖼️ Convert to AVIF 🎨'])
+    
+    return keyboard
+
+def get_conversion_keyboard(file_ext, is_photo=False):
+    """Get the appropriate keyboard layout for file conversion."""
+    keyboard = get_format_rows(file_ext, is_photo)
+    
+    # Offer several targets at once when there is more than one. A batch
+    # is already one output archive per format, so it gets one at a time.
+    if sum(len(row) for row in keyboard) > 1 and file_ext not in BATCH_FORMATS:
+        keyboard.append([CONVERT_ALL_BUTTON, CHOOSE_SEVERAL_BUTTON])
     
     # Always add exactly one cancel button at the end
     keyboard.append(['❌ Cancel ↩️'])
     
+    return keyboard
+
+def get_multi_selection_keyboard(file_ext, is_photo=False):
+    """Get the keyboard for picking several target formats."""
+    keyboard = get_format_rows(file_ext, is_photo)
+    keyboard.append([CONVERT_SELECTED_BUTTON])
+    keyboard.append(['❌ Cancel ↩️'])
     return keyboard 
\ No newline at end of file
@@ -13,7 +13,10 @@ MESSAGES = {
         '• JPG → PDF\n'
         '• JPG → PNG\n'
         '• PNG → PDF\n'
-        '• PNG → JPG\n\n'
+        '• PNG → JPG\n'
+        '• JPG/PNG → WEBP, AVIF (smaller files)\n\n'
+        '📦 Batches:\n'
+        '• ZIP → every file inside converted, returned as a ZIP\n\n'
         'Just send me a file and I\'ll show you the available conversion options!'
     ),
     'help': (
@@ -21,6 +24,9 @@ MESSAGES = {
         '1️⃣ Send me a file\n'
         '2️⃣ Choose the format you want to convert to\n'
         '3️⃣ Wait for the converted file\n\n'
+        '📦 Need several formats? Tap "Convert to all formats" or "Choose several"\n'
+        '⚡ Always convert a format the same way? Send /auto png pdf\n'
+        '🛑 Send /cancel to stop a running conversion\n\n'
         '📝 Supported Formats:\n\n'
         '📊 Spreadsheets:\n'
         '• CSV → PDF (Tables)\n'
@@ -30,12 +36,15 @@ MESSAGES = {
         '• JPG → PDF\n'
         '• JPG → PNG\n'
         '• PNG → PDF\n'
-        '• PNG → JPG\n\n'
-        '❗ Maximum file size: 20MB\n'
+        '• PNG → JPG\n'
+        '• JPG/PNG → WEBP, AVIF (smaller files)\n\n'
+        '📦 Batches:\n'
+        '• ZIP → every file inside converted, returned as a ZIP\n\n'
+        '❗ Maximum file size: {max_size}\n'
         '❓ Need help? Contact @YourUsername'
     ),
     'file_too_large': (
-        '❌ File is too large! Maximum size is 20MB.\n'
+        '❌ File is too large! Maximum size is {max_size}.\n'
         'Please compress your file and try again.\n\n'
         '💡 Tips:\n'
         '• Compress the file\n'
@@ -45,13 +54,101 @@ MESSAGES = {
     'unsupported_format': (
         '✅ I can handle these formats:\n'
         '📊 Spreadsheets: CSV, XLSX\n'
-        '🖼️ Images: JPG, JPEG, PNG\n\n'
+        '🖼️ Images: JPG, JPEG, PNG\n'
+        '📦 Batches: ZIP archives of the above\n\n'
         '💡 Tip: Make sure your file has the correct extension!'
     ),
+    'auto_converting': (
+        '⚡ Converting {input_format} to {output_format} automatically.\n'
+        'Send {command} to choose the format yourself again.'
+    ),
+    'auto_saved': '⚡ From now on I\'ll convert every {input_format} file to {output_format} right away.',
+    'auto_removed': '⚡ I\'ll ask again which format you want for {input_format} files.',
+    'auto_cleared': '⚡ Auto-convert is off for all formats.',
+    'auto_none': (
+        '⚡ No auto-convert preferences yet.\n'
+        'Send /auto <from> <to>, e.g. /auto png pdf, to convert files right away.'
+    ),
+    'auto_list': (
+        '⚡ Converted automatically:\n'
+        '{preferences}\n\n'
+        'Send /auto <from> off to remove one, or /auto off to remove all.'
+    ),
+    'auto_usage': (
+        'Usage:\n'
+        '/auto - list your preferences\n'
+        '/auto <from> <to> - always convert, e.g. /auto csv xlsx\n'
+        '/auto <from> off - ask again for a format\n'
+        '/auto off - remove all preferences'
+    ),
+    'format_detected': (
+        '🔎 This file is named as {claimed}, but it is actually {actual}.\n'
+        'I\'ll convert it as {actual}.'
+    ),
+    'format_mismatch': (
+        '❌ This file is named as {claimed}, but it is actually {actual}, which I can\'t convert.\n\n'
+        '💡 Tip: Make sure your file has the correct extension!'
+    ),
+    'format_unknown': (
+        '❌ This doesn\'t look like a valid {claimed} file.\n'
+        'It might be corrupted or in a different format.'
+    ),
     'choose_format': (
         '✨ Choose your conversion format:\n'
         'Tap the grid icon 🔲 below'
     ),
+    'choose_several': (
+        '☑️ Tap the formats you want, then "✅ Convert selected".\n'
+        'Tap a format again to remove it.'
+    ),
+    'selected_formats': 'Selected: {formats}',
+    'nothing_selected': 'Please pick at least one format first.',
+    'conversion_partial': '⚠️ Could not convert to: {formats}',
+    'conversion_done': (
+        '✅ Here\'s your converted file!\n'
+        '✨ Send me another file to convert!'
+    ),
+    'batch_done': (
+        '✅ Converted {converted} of {total} files to {format}!\n'
+        '✨ Send me another file to convert!'
+    ),
+    'batch_too_large': (
+        '❌ This archive is too big to convert.\n'
+        'It may contain at most {max_files} files and {max_size} of uncompressed content.\n\n'
+        '💡 Tip: Split it into smaller archives!'
+    ),
+    'batch_failed': '⚠️ {failed} file(s) could not be converted, see errors.txt in the archive.',
+    'cancelled': (
+        '❌ Operation cancelled.\n'
+        'Send me a new file when you\'re ready!'
+    ),
+    'cancelling': '🛑 Stopping your conversion...',
+    'nothing_to_cancel': (
+        'There is no conversion running.\n'
+        'Send me a file to get started!'
+    ),
+    'job_interrupted': (
+        '🔄 The bot is restarting and your conversion was paused.\n'
+        'It will continue automatically in a moment, no need to send the file again.'
+    ),
+    'job_limit': (
+        '⏱️ Sorry, converting this file took too long or needed too much memory.\n'
+        'Please try with a smaller file.'
+    ),
+    'profiling_on': '🔬 Profiling every conversion. Send /profile off to stop.',
+    'profiling_off': '🔬 Profiling only slow conversions.',
+    'no_profiles': '🔬 No profiles captured yet.',
+    'profile_list': (
+        '🔬 Recent profiles, newest first:\n'
+        '{profiles}\n\n'
+        'Send /profile <number> to get one as folded stacks for a flamegraph.'
+    ),
+    'profile_usage': (
+        'Usage:\n'
+        '/profile - list recent profiles\n'
+        '/profile <number> - get a profile\n'
+        '/profile on|off - profile every conversion'
+    ),
     'error_generic': (
         '❌ Sorry, something went wrong.\n'
         'Please try again or contact support if the problem persists.\n\n'
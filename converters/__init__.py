@@ -1,14 +1,25 @@
-from .image_converter import convert_image
-from .image_to_pdf import convert_image_to_pdf
-from .csv_to_pdf import convert_csv_to_pdf
-from .csv_to_xlsx import convert_csv_to_xlsx
-from .xlsx_to_csv import convert_xlsx_to_csv
-
-__all__ = [
-    'convert_image',
-    'convert_image_to_pdf',
-    'convert_docx_to_pdf',
-    'convert_csv_to_pdf',
-    'convert_csv_to_xlsx',
-    'convert_xlsx_to_csv',
-]
+"""File converters.
+
+Converter modules pull in heavy libraries (pandas, reportlab, openpyxl,
+Pillow, img2pdf), so they are only imported when a converter is first used.
+"""
+
+import importlib
+
+# Converter function -> module that defines it
+_CONVERTERS = {
+    'convert_image': 'image_converter',
+    'convert_image_to_pdf': 'image_to_pdf',
+    'convert_csv_to_pdf': 'csv_to_pdf',
+    'convert_csv_to_xlsx': 'csv_to_xlsx',
+    'convert_xlsx_to_csv': 'xlsx_to_csv',
+}
+
+def __getattr__(name: str):
+    module_name = _CONVERTERS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(f'.{module_name}', __name__)
+    return getattr(module, name)
+
+__all__ = list(_CONVERTERS)
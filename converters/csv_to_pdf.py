@@ -1,92 +1,244 @@
+import math
+import multiprocessing
 import os
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List, Optional, Tuple
+import fitz
 import pandas as pd
+from converters.shared import process_budget, read_csv
+from utils.profiling import merge_samples, sample_forked
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, landscape
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, PageBreak
 from reportlab.lib.enums import TA_CENTER
 
-def convert_csv_to_pdf(csv_path: str) -> str:
+PAGE_SIZE = landscape(letter)
+MARGIN = 30
+FRAME_PADDING = 6  # Padding reportlab adds inside the page frame
+
+# Table fonts and paddings; row heights follow from them
+HEADER_FONT, HEADER_FONT_SIZE = 'Helvetica-Bold', 14
+BODY_FONT, BODY_FONT_SIZE = 'Helvetica', 12
+HEADER_HEIGHT = HEADER_FONT_SIZE * 1.2 + 3 + 12
+LINE_HEIGHT = BODY_FONT_SIZE * 1.2
+ROW_PADDING = 6 + 6
+CELL_PADDING = 6 + 6
+
+# Longest values per column measured to size the columns
+WIDTH_SAMPLE = 50
+
+# Tables with fewer pages per shard than this are rendered in one process
+MIN_PAGES_PER_SHARD = 20
+
+TABLE_STYLE = TableStyle([
+    # Header style
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), HEADER_FONT),
+    ('FONTSIZE', (0, 0), (-1, 0), HEADER_FONT_SIZE),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    # Data style
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+    ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 1), (-1, -1), BODY_FONT),
+    ('FONTSIZE', (0, 1), (-1, -1), BODY_FONT_SIZE),
+    ('TOPPADDING', (0, 1), (-1, -1), 6),
+    ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+# Layout shared with the forked shard renderers
+_shared_layout: dict = {}
+
+def convert_csv_to_pdf(csv_path: str, df: Optional[pd.DataFrame] = None,
+                       load: float = 0.0) -> str:
     """
     Convert CSV file to PDF with formatted tables
     Args:
         csv_path (str): Path to the CSV file
+        df (pd.DataFrame, optional): The CSV contents, if already read
+        load (float): Current worker load, used to pick the number of shards
     Returns:
         str: Path to the converted PDF file
+
+    Rows are laid out on pages up front, with the same column widths and
+    header on every page. Large tables are split into shards of whole
+    pages that are rendered in parallel processes and merged with PyMuPDF,
+    using only the cores other jobs leave idle.
     """
+    global _shared_layout
     try:
         # Create temporary file for PDF
         temp_pdf = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
         temp_pdf.close()
 
         # Read CSV file
-        df = pd.read_csv(csv_path)
-        
-        # Create the PDF document
-        doc = SimpleDocTemplate(
-            temp_pdf.name,
-            pagesize=landscape(letter),
-            rightMargin=30,
-            leftMargin=30,
-            topMargin=30,
-            bottomMargin=30
-        )
-        
-        # Create styles
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            alignment=TA_CENTER,
-            spaceAfter=30
-        )
-        
-        # Create the elements to build the PDF
-        elements = []
-        
+        if df is None:
+            df = read_csv(csv_path)
+
         # Add title (using the CSV filename as title)
         title = os.path.splitext(os.path.basename(csv_path))[0]
         title = title.replace('_', ' ').replace('-', ' ').title()
-        elements.append(Paragraph(title, title_style))
-        
-        # Prepare table data
-        table_data = [df.columns.tolist()] + df.values.tolist()
-        
-        # Create table
-        table = Table(table_data)
-        
-        # Add style to table
-        style = TableStyle([
-            # Header style
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            # Data style
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 12),
-            ('TOPPADDING', (0, 1), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ])
-        table.setStyle(style)
-        
-        # Add table to elements
-        elements.append(table)
-        
-        # Build PDF
-        doc.build(elements)
-        
+
+        _shared_layout = layout_table(df, title)
+        pages = _shared_layout['pages']
+        shards = split_shards(len(pages), process_budget(load, len(pages)))
+
+        if len(shards) == 1:
+            render_shard(0, len(pages), temp_pdf.name)
+            return temp_pdf.name
+
+        # Render the shards in processes that inherit the layout copy-on-write
+        shard_paths = [f'{temp_pdf.name}.{index}' for index in range(len(shards))]
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=context) as executor:
+            # Sampled in the forked processes, so profiles show the rendering
+            for _, samples in executor.map(partial(sample_forked, render_shard),
+                                           *zip(*shards), shard_paths):
+                merge_samples(samples)
+
+        merge_pdfs(shard_paths, temp_pdf.name)
+        for path in shard_paths:
+            os.remove(path)
+
         return temp_pdf.name
-        
+
     except Exception as e:
         if os.path.exists(temp_pdf.name):
             os.remove(temp_pdf.name)
-        raise Exception(f"Error converting CSV to PDF: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"Error converting CSV to PDF: {str(e)}")
+    finally:
+        _shared_layout = {}
+
+def layout_table(df: pd.DataFrame, title: str) -> dict:
+    """
+    Lay out a table on pages
+    Args:
+        df (pd.DataFrame): The table
+        title (str): Title shown above the table on the first page
+    Returns:
+        dict: The title, column widths, row heights and the row range of every page
+    """
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        alignment=TA_CENTER,
+        spaceAfter=30
+    )
+
+    frame_width = PAGE_SIZE[0] - 2 * MARGIN - 2 * FRAME_PADDING
+    frame_height = PAGE_SIZE[1] - 2 * MARGIN - 2 * FRAME_PADDING
+    _, title_height = Paragraph(title, title_style).wrap(frame_width, frame_height)
+
+    row_heights = [LINE_HEIGHT * lines + ROW_PADDING for lines in _line_counts(df)]
+
+    # Fill pages with whole rows; one point of slack keeps reportlab from splitting a table
+    pages: List[Tuple[int, int]] = []
+    available = frame_height - title_height - title_style.spaceAfter - HEADER_HEIGHT - 1
+    start, used = 0, 0.0
+    for row, height in enumerate(row_heights):
+        if used + height > available and row > start:
+            pages.append((start, row))
+            available = frame_height - HEADER_HEIGHT - 1
+            start, used = row, 0.0
+        used += height
+    pages.append((start, len(row_heights)))
+
+    return {
+        'df': df,
+        'title': title,
+        'title_style': title_style,
+        'col_widths': _column_widths(df),
+        'row_heights': row_heights,
+        'pages': pages,
+    }
+
+def _column_widths(df: pd.DataFrame) -> List[float]:
+    """Width of every column, from its header and its longest values."""
+    widths = []
+    for index, column in enumerate(df.columns):
+        values = df.iloc[:, index].astype(str)
+        longest = values.loc[values.str.len().nlargest(WIDTH_SAMPLE).index]
+        width = max(
+            [_text_width(str(column), HEADER_FONT, HEADER_FONT_SIZE)]
+            + [_text_width(value, BODY_FONT, BODY_FONT_SIZE) for value in longest]
+        )
+        widths.append(width + CELL_PADDING)
+    return widths
+
+def _text_width(text: str, font: str, size: float) -> float:
+    return max(stringWidth(line, font, size) for line in text.split('\n'))
+
+def _line_counts(df: pd.DataFrame) -> List[int]:
+    """Number of text lines of every row."""
+    lines = pd.Series(1, index=df.index)
+    for index, dtype in enumerate(df.dtypes):
+        if dtype == object:
+            column = df.iloc[:, index].astype(str).str.count('\n') + 1
+            lines = lines.where(lines >= column, column)
+    return lines.tolist()
+
+def split_shards(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    """Split pages into contiguous page ranges, one per process."""
+    shard_count = max(1, min(workers, page_count // MIN_PAGES_PER_SHARD))
+    size = math.ceil(page_count / shard_count)
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+def render_shard(first_page: int, end_page: int, output_path: str) -> str:
+    """Render a range of pages of the laid out table to its own PDF."""
+    layout = _shared_layout
+    df, pages = layout['df'], layout['pages']
+    header = df.columns.tolist()
+
+    doc = SimpleDocTemplate(
+        output_path,
+        pagesize=PAGE_SIZE,
+        rightMargin=MARGIN,
+        leftMargin=MARGIN,
+        topMargin=MARGIN,
+        bottomMargin=MARGIN
+    )
+
+    elements = []
+    if first_page == 0:
+        elements.append(Paragraph(layout['title'], layout['title_style']))
+
+    for page in range(first_page, end_page):
+        start, end = pages[page]
+        table = Table(
+            [header] + df.iloc[start:end].values.tolist(),
+            colWidths=layout['col_widths'],
+            rowHeights=[HEADER_HEIGHT] + layout['row_heights'][start:end]
+        )
+        table.setStyle(TABLE_STYLE)
+        elements.append(table)
+        if page < end_page - 1:
+            elements.append(PageBreak())
+
+    def draw_page_number(canvas, doc):
+        canvas.saveState()
+        canvas.setFont(BODY_FONT, 9)
+        canvas.drawCentredString(
+            PAGE_SIZE[0] / 2, MARGIN / 2,
+            f'Page {first_page + doc.page} of {len(pages)}'
+        )
+        canvas.restoreState()
+
+    doc.build(elements, onFirstPage=draw_page_number, onLaterPages=draw_page_number)
+    return output_path
+
+def merge_pdfs(paths: List[str], output_path: str) -> None:
+    """Concatenate PDF files with PyMuPDF."""
+    with fitz.open() as merged:
+        for path in paths:
+            with fitz.open(path) as shard:
+                merged.insert_pdf(shard)
+        merged.save(output_path, garbage=1, deflate=True)
@@ -1,15 +1,18 @@
 import os
 import tempfile
+from typing import Optional
 import pandas as pd
+from converters.shared import read_csv
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
 
-def convert_csv_to_xlsx(csv_path: str) -> str:
+def convert_csv_to_xlsx(csv_path: str, df: Optional[pd.DataFrame] = None) -> str:
     """
     Convert CSV file to XLSX format with formatting
     Args:
         csv_path (str): Path to the CSV file
+        df (pd.DataFrame, optional): The CSV contents, if already read
     Returns:
         str: Path to the converted XLSX file
     """
@@ -19,7 +22,8 @@ def convert_csv_to_xlsx(csv_path: str) -> str:
         temp_xlsx.close()
 
         # Read CSV file
-        df = pd.read_csv(csv_path)
+        if df is None:
+            df = read_csv(csv_path)
         
         # Create a new workbook and select the active sheet
         wb = Workbook()
@@ -1,9 +1,40 @@
-from PIL import Image
+from PIL import Image, ImageChops
+from contextlib import nullcontext
+from io import BytesIO
+from typing import Optional
 import logging
 import os
+import zlib
+
+try:
+    import pillow_avif  # noqa: F401 - registers the AVIF plugin with Pillow
+except ImportError:
+    pillow_avif = None
 
 MAX_DIMENSION = 1920  # Maximum width or height for images
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB - Telegram's file size limit
+MIN_BYTE_BUDGET = 256 * 1024  # Lossy output may always use at least this much
+MIN_QUALITY = 60  # Don't go below quality 60
+MAX_QUALITY = 95
+GRAPHIC_MAX_COLORS = 1024  # Images with fewer colours are treated as graphics
+
+# PNG encoder profiles, from fastest to smallest output. compress_type is
+# the zlib strategy; optimize makes Pillow try every row filter.
+PNG_PROFILES = {
+    'fast': {'compress_level': 1, 'compress_type': zlib.Z_RLE},
+    'balanced': {'compress_level': 6},
+    'max': {'compress_level': 9, 'optimize': True},
+}
+LARGE_IMAGE_PIXELS = 2_000_000  # Above this, maximum compression costs too much time
+BUSY_LOAD = 0.5  # Worker load above which encoding favours speed
+HIGH_LOAD = 1.0  # Every worker busy and jobs queued
+
+# Pillow format names and lossy encoder options per output format
+PIL_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'avif': 'AVIF'}
+LOSSY_OPTIONS = {
+    'jpg': {'optimize': True},
+    'webp': {'method': 4},
+    'avif': {'speed': 8},
+}
 
 def resize_if_needed(img: Image.Image) -> Image.Image:
     """Resize image if it exceeds maximum dimensions."""
@@ -22,48 +53,152 @@ def resize_if_needed(img: Image.Image) -> Image.Image:
         return img.resize((new_width, new_height), Image.Resampling.LANCZOS)
     return img
 
-def convert_image(input_path: str, output_format: str) -> str:
+def is_graphic(img: Image.Image) -> bool:
+    """
+    Tell screenshots, diagrams and other graphics apart from photos.
+    Graphics use few distinct colours and compress better losslessly.
+    """
+    sample = img.copy()
+    sample.thumbnail((256, 256), Image.Resampling.NEAREST)  # NEAREST adds no new colours
+    return sample.getcolors(maxcolors=GRAPHIC_MAX_COLORS) is not None
+
+def choose_png_profile(img: Image.Image, load: float) -> dict:
+    """
+    Pick PNG encoder settings from the image size and the worker load
+    Args:
+        img (Image.Image): Image to encode
+        load (float): Running and queued jobs per worker slot
+    Returns:
+        dict: Pillow save options
+    """
+    large = img.width * img.height > LARGE_IMAGE_PIXELS
+    if load >= HIGH_LOAD or (large and load >= BUSY_LOAD):
+        profile = 'fast'
+    elif large or load >= BUSY_LOAD:
+        profile = 'balanced'
+    else:
+        profile = 'max'
+    logging.info(f"Using PNG profile '{profile}' (load={load:.2f}, size={img.size})")
+    return PNG_PROFILES[profile]
+
+def to_palette(img: Image.Image) -> Image.Image:
+    """
+    Losslessly convert an RGB(A) image with at most 256 colours to palette mode.
+    Returns the image unchanged if it has more colours. Greyscale images are
+    left alone, as they already use one byte per pixel.
+    """
+    if img.mode not in ('RGB', 'RGBA') or img.getcolors(maxcolors=256) is None:
+        return img
+    method = Image.Quantize.FASTOCTREE if img.mode == 'RGBA' else Image.Quantize.MEDIANCUT
+    palette_img = img.quantize(colors=256, method=method)
+    # Only keep the palette version if no pixel changed
+    if ImageChops.difference(palette_img.convert(img.mode), img).getbbox() is not None:
+        return img
+    logging.info("Using a palette for PNG output")
+    return palette_img
+
+def get_byte_budget(input_path: str, max_size: int = 0) -> int:
+    """Bytes a lossy output may use: no more than the input, within max_size (0: no limit)."""
+    budget = max(os.path.getsize(input_path), MIN_BYTE_BUDGET)
+    return min(budget, max_size) if max_size else budget
+
+def encode(img: Image.Image, output_format: str, **options) -> bytes:
+    """Encode an image in memory."""
+    buffer = BytesIO()
+    img.save(buffer, PIL_FORMATS[output_format], **options)
+    return buffer.getvalue()
+
+def encode_lossy(img: Image.Image, output_format: str, budget: int) -> bytes:
+    """
+    Encode with the highest quality that fits into the byte budget
+    Args:
+        img (Image.Image): Image to encode
+        output_format (str): 'jpg', 'webp' or 'avif'
+        budget (int): Target size in bytes
+    Returns:
+        bytes: Encoded image, at MIN_QUALITY if even that exceeds the budget
+    """
+    options = LOSSY_OPTIONS[output_format]
+    low, high = MIN_QUALITY, MAX_QUALITY
+    best, best_quality = None, MIN_QUALITY
+    # Binary search for the highest quality within budget
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode(img, output_format, quality=quality, **options)
+        if len(data) <= budget:
+            best, best_quality = data, quality
+            low = quality + 1
+        else:
+            high = quality - 1
+    if best is None:
+        best = encode(img, output_format, quality=MIN_QUALITY, **options)
+    logging.info(f"Encoded {output_format} at quality {best_quality}: {len(best)} bytes (budget {budget})")
+    return best
+
+def prepare_mode(img: Image.Image, output_format: str) -> Image.Image:
+    """Convert the image to a mode the output format can store."""
+    if output_format == 'jpg':
+        if img.mode not in ('RGB', 'L'):
+            logging.info(f"Converted {img.mode} to RGB for JPG output")
+            return img.convert('RGB')
+    elif output_format in ('webp', 'avif'):
+        if img.mode not in ('RGB', 'RGBA'):
+            has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+            return img.convert('RGBA' if has_alpha else 'RGB')
+    return img
+
+def convert_image(input_path: str, output_format: str, load: float = 0.0,
+                  max_size: int = 0, image: Optional[Image.Image] = None) -> str:
     """
-    Convert image between JPG and PNG formats
+    Convert image to JPG, PNG, WebP or AVIF format
     Args:
         input_path (str): Path to input image file
-        output_format (str): Target format ('jpg' or 'png')
+        output_format (str): Target format ('jpg', 'png', 'webp' or 'avif')
+        load (float): Current worker load, used to pick the PNG encoder profile
+        max_size (int): Configured output size limit, lossy output is kept within it
+        image (Image.Image, optional): The image, if already opened
     Returns:
         str: Path to the converted image file
     """
     output_path = None
+    output_format = output_format.lower()
     try:
         if not os.path.exists(input_path):
             raise FileNotFoundError(f"Input file not found: {input_path}")
+
+        if output_format == 'avif' and pillow_avif is None:
+            raise ImportError("AVIF support requires pillow-avif-plugin")
             
         # Open the image
-        with Image.open(input_path) as img:
+        with (nullcontext(image) if image is not None else Image.open(input_path)) as img:
             # Log image details for debugging
             logging.info(f"Converting image: mode={img.mode}, size={img.size}, format={img.format}")
             
             # Resize image if too large
             img = resize_if_needed(img)
-            
-            # If image is in RGBA mode and converting to JPG, convert to RGB first
-            if img.mode == 'RGBA' and output_format.lower() == 'jpg':
-                img = img.convert('RGB')
-                logging.info("Converted RGBA to RGB for JPG output")
+            img = prepare_mode(img, output_format)
             
             # Create output path
-            output_path = input_path.rsplit('.', 1)[0] + '.' + output_format.lower()
+            output_path = input_path.rsplit('.', 1)[0] + '.' + output_format
+            if output_path == input_path:
+                # Never write over the input, other converters may still read it
+                output_path = input_path.rsplit('.', 1)[0] + '-converted.' + output_format
+            budget = get_byte_budget(input_path, max_size)
             
             # Save with optimal settings
-            if output_format.lower() == 'jpg':
-                # Try different quality settings to get optimal file size
-                quality = 95
-                while quality > 60:  # Don't go below quality 60
-                    img.save(output_path, 'JPEG', quality=quality, optimize=True)
-                    if os.path.getsize(output_path) <= MAX_FILE_SIZE:  
-                        break
-                    quality -= 5
-            else:  # PNG
-                # For PNG, use maximum compression
-                img.save(output_path, 'PNG', optimize=True, compress_level=9)
+            if output_format == 'png':
+                # Only spend CPU on maximum compression when there is some to spare
+                data = encode(to_palette(img), 'png', **choose_png_profile(img, load))
+            elif output_format == 'webp' and is_graphic(img):
+                # Screenshots and diagrams: lossless unless that blows the budget
+                data = encode(img, 'webp', lossless=True, quality=80, method=4)
+                if len(data) > budget:
+                    data = encode_lossy(img, 'webp', budget)
+            else:
+                data = encode_lossy(img, output_format, budget)
+
+            with open(output_path, 'wb') as f:
+                f.write(data)
             
             # Verify the output file was created
             if not os.path.exists(output_path):
@@ -72,13 +207,11 @@ def convert_image(input_path: str, output_format: str) -> str:
             if os.path.getsize(output_path) == 0:
                 raise Exception("Output file is empty")
                 
-            # Check if file size is within Telegram's limit
-            if os.path.getsize(output_path) > MAX_FILE_SIZE:
-                raise Exception("Converted file exceeds Telegram's size limit")
-                
             logging.info(f"Successfully converted image to {output_format}")
             return output_path
             
+    except ImportError:
+        raise
     except Exception as e:
         if output_path and os.path.exists(output_path):
             try:
@@ -1,13 +1,16 @@
 import os
 import tempfile
+from contextlib import nullcontext
+from typing import Optional
 from PIL import Image
 import img2pdf
 
-def convert_image_to_pdf(image_path: str) -> str:
+def convert_image_to_pdf(image_path: str, image: Optional[Image.Image] = None) -> str:
     """
     Convert image (JPG/PNG) to PDF format
     Args:
         image_path (str): Path to the image file
+        image (Image.Image, optional): The image, if already opened
     Returns:
         str: Path to the converted PDF file
     """
@@ -17,7 +20,7 @@ def convert_image_to_pdf(image_path: str) -> str:
         temp_pdf.close()
         
         # Open and convert image if needed
-        with Image.open(image_path) as img:
+        with (nullcontext(image) if image is not None else Image.open(image_path)) as img:
             # Convert to RGB if needed
             if img.mode in ('RGBA', 'LA'):
                 rgb_img = Image.new('RGB', img.size, (255, 255, 255))
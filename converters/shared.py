@@ -0,0 +1,60 @@
+"""Decode an input file once so that several converters can share it."""
+
+import multiprocessing
+import os
+from typing import Any, Dict
+
+from utils.sniffing import SNIFF_SIZE, decode_text, sniff_csv_dialect
+
+def process_budget(load: float, wanted: int) -> int:
+    """
+    Number of processes a job may run at once without oversubscribing the machine
+    Args:
+        load (float): Other active jobs per worker slot
+        wanted (int): Processes the job could use
+    Returns:
+        int: The job's share of the cores left idle by other jobs, at least 1.
+        Always 1 where processes cannot be forked.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return 1
+    if hasattr(os, 'sched_getaffinity'):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    spare = int(cores * max(0.0, 1.0 - load))
+    return max(1, min(wanted, spare))
+
+def read_csv(csv_path: str):
+    """
+    Read a CSV file into a DataFrame, in the dialect detected from its start
+    Args:
+        csv_path (str): Path to the CSV file
+    Returns:
+        pd.DataFrame: The CSV contents
+    """
+    import pandas as pd
+    with open(csv_path, 'rb') as f:
+        text = decode_text(f.read(SNIFF_SIZE))
+    dialect = sniff_csv_dialect(text) if text else None
+    if dialect is None:
+        return pd.read_csv(csv_path)
+    return pd.read_csv(csv_path, sep=dialect.delimiter, quotechar=dialect.quotechar)
+
+def decode_input(input_format: str, input_path: str) -> Dict[str, Any]:
+    """
+    Read an input file for sharing between converters
+    Args:
+        input_format (str): Normalized input format
+        input_path (str): Path to the input file
+    Returns:
+        Dict[str, Any]: Keyword arguments that let the converters skip reading the file
+    """
+    if input_format == 'csv':
+        return {'df': read_csv(input_path)}
+    if input_format in ['jpg', 'jpeg', 'png']:
+        from PIL import Image
+        image = Image.open(input_path)
+        image.load()
+        return {'image': image}
+    return {}
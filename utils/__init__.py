@@ -1,9 +1,11 @@
 """Utility functions for the bot."""
 
 import os
+import shutil
 import logging
-from typing import Dict, Union
-from telegram import Update
+from typing import Dict, Optional, Union
+import httpx
+from telegram import File, Update
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +41,10 @@ def format_file_info(file_name: str, file_size: int, file_ext: str) -> str:
         f'🏷️ Type: {file_ext.upper()}'
     )
 
+def format_size(size: int) -> str:
+    """Format a size limit in bytes for messages."""
+    return f'{size // (1024 * 1024)}MB'
+
 def extract_format_from_button(button_text: str) -> str:
     """Extract format from button text."""
     text = button_text.lower()
@@ -56,6 +62,48 @@ def extract_format_from_button(button_text: str) -> str:
         .replace('❌ cancel', 'cancel')
         .strip())
 
+async def fetch_file(file: File, path: str) -> str:
+    """
+    Make a Telegram file available at the given path.
+
+    With a local Bot API server the file already is on this machine, so it is
+    linked into place instead of being copied or downloaded.
+    """
+    if os.path.isabs(file.file_path) and os.path.isfile(file.file_path):
+        try:
+            os.symlink(file.file_path, path)
+        except OSError:
+            shutil.copyfile(file.file_path, path)
+    else:
+        await file.download_to_drive(path)
+    return path
+
+async def read_file_head(file: File, size: int) -> Optional[bytes]:
+    """
+    Read the first bytes of a Telegram file without downloading all of it.
+    Returns None if the file could not be read.
+    """
+    try:
+        if os.path.isabs(file.file_path) and os.path.isfile(file.file_path):
+            with open(file.file_path, 'rb') as f:
+                return f.read(size)
+
+        head = bytearray()
+        async with httpx.AsyncClient(timeout=30) as client:
+            # Servers that ignore the range still only send what is read
+            headers = {'Range': f'bytes=0-{size - 1}'}
+            async with client.stream('GET', file.file_path, headers=headers) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    head += chunk
+                    if len(head) >= size:
+                        break
+        return bytes(head[:size])
+    except (OSError, httpx.HTTPError) as e:
+        # Cloud file URLs contain the bot token, so they are not logged
+        logger.warning(f"Could not read the start of a file: {type(e).__name__}")
+        return None
+
 async def cleanup_files(*paths: str) -> None:
     """Clean up temporary files."""
     for path in paths:
@@ -78,14 +126,37 @@ class UnsupportedFormatError(ConversionError):
     """Exception raised for unsupported format conversions."""
     pass
 
+class JobCancelledError(ConversionError):
+    """Exception raised when a conversion job is cancelled by the user."""
+    pass
+
+class JobInterruptedError(ConversionError):
+    """Exception raised when a conversion job is stopped because the bot shuts down."""
+    pass
+
+class JobLimitError(ConversionError):
+    """Exception raised when a conversion job exceeds its time or resource limits."""
+    pass
+
+class BatchLimitError(ConversionError):
+    """Exception raised when an archive has too many files or too much content."""
+    pass
+
 # Export all functions and classes
 __all__ = [
     'get_file_info',
     'normalize_file_extension',
     'format_file_info',
+    'format_size',
     'extract_format_from_button',
+    'fetch_file',
+    'read_file_head',
     'cleanup_files',
     'ConversionError',
     'FileSizeError',
-    'UnsupportedFormatError'
+    'UnsupportedFormatError',
+    'JobCancelledError',
+    'JobInterruptedError',
+    'JobLimitError',
+    'BatchLimitError'
 ]
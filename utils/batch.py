@@ -0,0 +1,142 @@
+"""Batch conversion of the files inside a zip archive."""
+
+import asyncio
+import logging
+import os
+import shutil
+import zipfile
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config.formats import SUPPORTED_FORMATS
+from utils import (
+    normalize_file_extension,
+    BatchLimitError,
+    JobCancelledError,
+    JobInterruptedError
+)
+from utils.worker import ConversionJob
+
+logger = logging.getLogger(__name__)
+
+ERRORS_FILE_NAME = 'errors.txt'
+
+def list_members(archive: zipfile.ZipFile, max_files: int, max_size: int) -> list:
+    """Return the files of an archive, rejecting archives that are too large."""
+    members = [
+        member for member in archive.infolist()
+        if not member.is_dir()
+        and not member.filename.startswith('__MACOSX/')
+        and not os.path.basename(member.filename).startswith('.')
+    ]
+    if len(members) > max_files:
+        raise BatchLimitError(f"Archive contains more than {max_files} files")
+    # Sizes from the archive index, so that zip bombs are refused before extraction
+    if sum(member.file_size for member in members) > max_size:
+        raise BatchLimitError(f"Archive contents exceed {max_size} bytes")
+    return members
+
+def output_names(members: list, output_format: str) -> List[str]:
+    """
+    Name of every converted file in the output archive: the member name with
+    the new extension, or with the new extension added where that would
+    collide (a.png and a.jpg become a.png.pdf and a.jpg.pdf), and a counter
+    if even that is taken.
+    """
+    stems = Counter(os.path.splitext(member.filename)[0] for member in members)
+    names, used = [], set()
+    for member in members:
+        stem = os.path.splitext(member.filename)[0]
+        base = stem if stems[stem] == 1 else member.filename
+        name, counter = f'{base}.{output_format}', 1
+        while name in used:
+            counter += 1
+            name = f'{base} ({counter}).{output_format}'
+        used.add(name)
+        names.append(name)
+    return names
+
+async def convert_archive(job: ConversionJob, archive_path: str, output_format: str,
+                          output_path: str, max_files: int, max_size: int,
+                          on_progress: Optional[Callable[[int, int], None]] = None
+                          ) -> Tuple[int, Dict[str, str]]:
+    """
+    Convert every file in a zip archive to one format
+    Args:
+        job (ConversionJob): Job to run the conversions in
+        archive_path (str): Path to the input zip archive
+        output_format (str): Target format for every file
+        output_path (str): Path of the zip archive to write the results to
+        max_files (int): Maximum number of files in the archive
+        max_size (int): Maximum total uncompressed size of the archive
+        on_progress (Callable, optional): Called with (done, total) after each file
+    Returns:
+        Tuple[int, Dict[str, str]]: Number of converted files, and the error per failed file
+
+    Files are converted in parallel, up to one per worker slot, and each
+    result is added to the output archive as soon as it is ready, so neither
+    the input nor the output batch is ever held in memory or fully on disk.
+    A failing file is recorded in errors.txt instead of failing the batch.
+    """
+    errors: Dict[str, str] = {}
+    done = 0
+
+    with zipfile.ZipFile(archive_path) as archive, \
+            zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED) as output:
+        members = list_members(archive, max_files, max_size)
+        arcnames = output_names(members, output_format)
+        in_flight = asyncio.Semaphore(job.pool.max_jobs)
+        write_lock = asyncio.Lock()
+
+        def extract(member: zipfile.ZipInfo, path: str) -> None:
+            with archive.open(member) as source, open(path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+
+        async def convert_member(index: int, member: zipfile.ZipInfo) -> None:
+            nonlocal done
+            name = member.filename
+            member_format = normalize_file_extension(name)
+            member_dir = os.path.join(job.work_dir, 'members', str(index))
+            try:
+                if output_format not in SUPPORTED_FORMATS.get(member_format, []):
+                    errors[name] = f"cannot convert {member_format.upper() or 'this file'} to {output_format.upper()}"
+                    return
+
+                async with in_flight:
+                    os.makedirs(member_dir, exist_ok=True)
+                    member_path = os.path.join(member_dir, os.path.basename(name))
+                    await asyncio.to_thread(extract, member, member_path)
+                    result_path = await job.run(member_format, output_format, member_path)
+
+                    try:
+                        async with write_lock:
+                            await asyncio.to_thread(output.write, result_path, arcnames[index])
+                    finally:
+                        # Converters may write outside member_dir, into the job's temp dir
+                        os.remove(result_path)
+            except (JobCancelledError, JobInterruptedError):
+                raise
+            except Exception as e:
+                logger.warning(f"Batch member {name} failed: {str(e)}")
+                # Do not leak the layout of the working directory into errors.txt
+                errors[name] = (str(e) or type(e).__name__).replace(member_dir + os.sep, '')
+            finally:
+                shutil.rmtree(member_dir, ignore_errors=True)
+                done += 1
+                if on_progress:
+                    on_progress(done, len(members))
+
+        results = await asyncio.gather(
+            *(convert_member(index, member) for index, member in enumerate(members)),
+            return_exceptions=True
+        )
+        # Cancelling the job stops the whole batch
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        if errors:
+            report = '\n'.join(f'{name}: {error}' for name, error in sorted(errors.items()))
+            output.writestr(ERRORS_FILE_NAME, report + '\n')
+
+    return len(members) - len(errors), errors
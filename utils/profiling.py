@@ -0,0 +1,134 @@
+"""Low-overhead profiling of conversions in the worker processes."""
+
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+SAMPLE_INTERVAL = 0.01  # seconds between two stack samples
+
+# Sampler running in this process, if any. Forked processes inherit it.
+_current: Optional['StackSampler'] = None
+
+class StackSampler:
+    """
+    Sample the stack of the thread that enters it, at a fixed interval.
+
+    Samples are aggregated as folded stacks ("outer;inner count" lines), the
+    input format of flamegraph.pl, inferno and speedscope. A sample costs a
+    few microseconds, so the sampler can stay on for every job.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._target: Optional[int] = None
+        self._pid: Optional[int] = None
+        self._previous: Optional[StackSampler] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'StackSampler':
+        global _current
+        self._target = threading.get_ident()
+        self._pid = os.getpid()
+        self._previous, _current = _current, self
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        global _current
+        self._stopped.set()
+        self._thread.join()
+        _current = self._previous
+
+    def running_here(self) -> bool:
+        """Whether the sampler runs in this process, not in the process that forked it."""
+        return self._pid == os.getpid()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self.samples[_fold(frame)] += 1
+
+    def folded(self) -> str:
+        """Return the samples as folded stacks, most frequent first."""
+        return _format_folded(self.samples)
+
+def sample_forked(func: Callable, *args) -> Tuple[Any, Optional[Counter]]:
+    """
+    Run func(*args) in a forked process, sampling it if the process that
+    forked it is being sampled. Returns the result and the samples, which
+    the forking process adds to its own with merge_samples().
+    """
+    if _current is None:
+        return func(*args), None
+    with StackSampler(_current.interval) as sampler:
+        result = func(*args)
+    return result, sampler.samples
+
+def merge_samples(samples: Optional[Counter]) -> None:
+    """Add the samples of a forked process to the sampler running in this process."""
+    if samples and _current is not None and _current.running_here():
+        _current.samples.update(samples)
+
+def dump_on_signal(signum: int, directory: str) -> None:
+    """
+    On signal signum, write the samples of this process and of the
+    processes it forks to directory, one file per process. Lets a job
+    that is about to be killed report its profile.
+    """
+    def dump(*_) -> None:
+        sampler = _current
+        if sampler is None or not sampler.running_here():
+            return
+        path = dump_path(directory, os.getpid())
+        with open(f'{path}.tmp', 'w') as f:
+            f.write(_format_folded(Counter(sampler.samples)))
+        # Readers only ever see complete files
+        os.replace(f'{path}.tmp', path)
+
+    signal.signal(signum, dump)
+
+def dump_path(directory: str, pid: int) -> str:
+    """Path of the samples that dump_on_signal() writes for a process."""
+    return os.path.join(directory, f'{pid}.folded')
+
+def read_dumps(directory: str) -> str:
+    """Merge the samples written by dump_on_signal() into folded stacks."""
+    samples: Counter = Counter()
+    for name in os.listdir(directory):
+        if name.endswith('.folded'):
+            with open(os.path.join(directory, name)) as f:
+                for line in f:
+                    stack, count = line.rsplit(' ', 1)
+                    samples[stack] += int(count)
+    return _format_folded(samples)
+
+def _format_folded(samples: Counter) -> str:
+    return ''.join(f'{stack} {count}\n' for stack, count in samples.most_common())
+
+def _fold(frame) -> str:
+    """Format a stack as 'module:function' frames from the outermost to the innermost."""
+    frames = []
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '?')
+        frames.append(f'{module}:{frame.f_code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+def describe_profile(profile: Dict[str, Any]) -> str:
+    """One line summary of a captured profile."""
+    outputs = profile['output_formats']
+    return (
+        f"{profile['duration']:.1f}s {profile['input_format'].upper()} → "
+        f"{', '.join(f.upper() for f in outputs)} "
+        f"{profile['file_name']} ({round(profile['file_size'] / (1024 * 1024), 2)} MB), "
+        f"chat {profile['chat_id']}, {profile['status']}, "
+        f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(profile['finished']))}"
+    )
@@ -0,0 +1,88 @@
+"""Throttled progress reporting for running conversions."""
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from telegram import Bot, Message
+from telegram.constants import ChatAction
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+SHOW_AFTER = 3.0  # Seconds before a status message is posted at all
+MIN_EDIT_INTERVAL = 3.0  # Minimum seconds between two status edits
+CHAT_ACTION_INTERVAL = 4.5  # Telegram shows a chat action for about 5 seconds
+TICK = 0.25  # How often pending updates are checked
+
+class ProgressReporter:
+    """
+    Report the progress of a job with as few Bot API calls as possible.
+
+    Jobs that finish within SHOW_AFTER seconds only show a chat action.
+    Slower jobs get a status message showing the latest stage, edited at
+    most every MIN_EDIT_INTERVAL seconds, so stages that finish in between
+    are skipped. The status message is deleted when the reporter exits.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, action: str = ChatAction.UPLOAD_DOCUMENT,
+                 show_after: float = SHOW_AFTER, min_interval: float = MIN_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.action = action
+        self.show_after = show_after
+        self.min_interval = min_interval
+        self._text: Optional[str] = None
+        self._shown_text: Optional[str] = None
+        self._status_message: Optional[Message] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> 'ProgressReporter':
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if self._status_message:
+            try:
+                await self._status_message.delete()
+            except TelegramError as e:
+                logger.debug(f"Could not delete progress message: {str(e)}")
+
+    def update(self, text: str) -> None:
+        """Set the current stage. It is shown on the next allowed edit."""
+        self._text = text
+
+    async def _run(self) -> None:
+        started = time.monotonic()
+        last_edit = 0.0
+        next_action = 0.0
+
+        while True:
+            now = time.monotonic()
+            try:
+                if (now - started >= self.show_after
+                        and self._text != self._shown_text
+                        and now - last_edit >= self.min_interval):
+                    text = self._text
+                    if self._status_message is None:
+                        self._status_message = await self.bot.send_message(self.chat_id, text)
+                    else:
+                        await self._status_message.edit_text(text)
+                    self._shown_text = text
+                    last_edit = now
+                elif self._status_message is None and now >= next_action:
+                    await self.bot.send_chat_action(self.chat_id, self.action)
+                    next_action = now + CHAT_ACTION_INTERVAL
+            except TelegramError as e:
+                # Progress is best effort and must never fail the job
+                logger.debug(f"Progress update failed: {str(e)}")
+                last_edit = now
+                next_action = now + CHAT_ACTION_INTERVAL
+
+            await asyncio.sleep(TICK)
@@ -0,0 +1,75 @@
+"""Detect the real format of a file from its first bytes."""
+
+import codecs
+import csv
+from typing import Optional
+
+# Bytes read to detect the format. Enough for the zip entry names of an
+# XLSX file and a few lines of a CSV file.
+SNIFF_SIZE = 8 * 1024
+
+# Delimiters tried when detecting the CSV dialect
+CSV_DELIMITERS = ',;\t|'
+
+# (claimed, detected) pairs that are accepted, mostly formats sharing a container
+_COMPATIBLE_FORMATS = {
+    ('csv', 'txt'),  # Single column CSV files have no delimiter to detect
+    ('xlsx', 'zip'),
+    ('zip', 'xlsx'),
+    ('zip', 'docx'),
+}
+
+def detect_format(head: bytes) -> Optional[str]:
+    """
+    Detect the format of a file from its first bytes
+    Args:
+        head (bytes): The first SNIFF_SIZE bytes of the file
+    Returns:
+        Optional[str]: Normalized format, 'txt' for text that is not CSV,
+        or None if the content is not recognized
+    """
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head.startswith(b'%PDF-'):
+        return 'pdf'
+    if head.startswith(b'PK\x03\x04'):
+        # Office files are zip archives, told apart by their entry names
+        if b'xl/' in head:
+            return 'xlsx'
+        if b'word/' in head:
+            return 'docx'
+        return 'zip'
+    text = decode_text(head)
+    if text is None:
+        return None
+    return 'csv' if sniff_csv_dialect(text) else 'txt'
+
+def decode_text(head: bytes) -> Optional[str]:
+    """Decode the start of a UTF-8 text file, or return None for binary content."""
+    if b'\x00' in head:
+        return None
+    # The head may end in the middle of a character
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    try:
+        return decoder.decode(head, final=False)
+    except UnicodeDecodeError:
+        return None
+
+def sniff_csv_dialect(text: str) -> Optional[csv.Dialect]:
+    """Detect the dialect of CSV text, or return None if it does not look like CSV."""
+    lines = text.splitlines()
+    if len(lines) > 1:
+        # The last line may be cut off
+        lines = lines[:-1]
+    try:
+        return csv.Sniffer().sniff('\n'.join(lines), delimiters=CSV_DELIMITERS)
+    except csv.Error:
+        return None
+
+def formats_match(claimed: str, detected: str) -> bool:
+    """Whether a file named as one format may contain the other."""
+    return claimed == detected or (claimed, detected) in _COMPATIBLE_FORMATS
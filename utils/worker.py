@@ -0,0 +1,514 @@
+"""Run conversions in isolated, cancellable worker processes."""
+
+import asyncio
+import inspect
+import logging
+import multiprocessing
+import os
+import sys
+import shutil
+import signal
+import tempfile
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Union
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from config.formats import IMAGE_OUTPUT_FORMATS, import_converter
+from converters.shared import decode_input, process_budget
+from utils import (
+    ConversionError,
+    FileSizeError,
+    UnsupportedFormatError,
+    JobCancelledError,
+    JobInterruptedError,
+    JobLimitError
+)
+from utils.profiling import (
+    StackSampler,
+    dump_on_signal,
+    dump_path,
+    merge_samples,
+    read_dumps,
+    sample_forked
+)
+
+logger = logging.getLogger(__name__)
+
+# Modules the fork server imports once, so that every worker starts warm.
+# '__main__' lets workers skip re-importing the bot script.
+PRELOAD_MODULES = [
+    '__main__',
+    'converters.image_converter',
+    'converters.image_to_pdf',
+    'converters.csv_to_pdf',
+    'converters.csv_to_xlsx',
+    'converters.xlsx_to_csv',
+]
+
+# Conversions are parallelised with processes. Keep numerical libraries
+# single-threaded, so that worker processes can safely fork.
+os.environ.setdefault('OPENBLAS_NUM_THREADS', '1')
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+
+# Libraries that only workers need; the bot process should never import them
+HEAVY_MODULES = ['pandas', 'numpy', 'reportlab', 'openpyxl', 'PIL', 'img2pdf', 'fitz']
+
+# How often a running job checks for results, cancellation and timeouts
+POLL_INTERVAL = 0.1  # seconds
+
+# How long a timed out worker gets to write its profile before it is killed
+PROFILE_DUMP_WAIT = 1.0  # seconds
+
+# Signal asking a worker and the processes it forked to write their profile
+_DUMP_SIGNAL = getattr(signal, 'SIGUSR1', None)
+
+# Exit code of a worker that ran out of memory before it could report back
+_EXIT_OUT_OF_MEMORY = 3
+
+# Errors raised inside the worker that keep their meaning in the bot process
+_WORKER_ERRORS = {
+    'FileSizeError': FileSizeError,
+    'UnsupportedFormatError': UnsupportedFormatError,
+    'ImportError': UnsupportedFormatError,
+}
+
+def run_converter(input_format: str, output_format: str, input_path: str,
+                  load: float = 0.0, max_output_size: int = 0,
+                  decoded: Optional[Dict[str, Any]] = None) -> str:
+    """Look up the converter for a format pair and run it."""
+    converter = import_converter(input_format, output_format)
+    if not converter:
+        raise UnsupportedFormatError("Conversion not supported")
+
+    # A copy per call: decoded is shared by every format of a run_converters() job
+    kwargs = dict(decoded or {})
+    if output_format in IMAGE_OUTPUT_FORMATS:
+        return converter(input_path, output_format, load=load, max_size=max_output_size, **kwargs)
+    if 'load' in inspect.signature(converter).parameters:
+        # Converters that run several processes size them by the load
+        kwargs['load'] = load
+    return converter(input_path, **kwargs)
+
+# Decoded input shared with the forked processes of run_converters()
+_shared_input: Dict[str, Any] = {}
+
+def _run_shared(input_format: str, output_format: str, input_path: str, load: float,
+                max_output_size: int) -> tuple:
+    try:
+        return ('ok', run_converter(input_format, output_format, input_path, load,
+                                    max_output_size, _shared_input))
+    except MemoryError:
+        return ('error', 'MemoryError', 'Memory limit exceeded')
+    except Exception as e:
+        return ('error', type(e).__name__, str(e))
+
+def run_converters(input_format: str, output_formats: List[str], input_path: str,
+                   load: float = 0.0, max_output_size: int = 0) -> Dict[str, tuple]:
+    """
+    Convert one input to several formats, reading and decoding it only once.
+
+    The decoded input is inherited copy-on-write by forked processes, so the
+    formats are rendered in parallel, with no more processes than the cores
+    other jobs leave idle. Returns a result tuple per format, so that one
+    failing format does not fail the others.
+    """
+    global _shared_input
+    _shared_input = decode_input(input_format, input_path)
+    args = [
+        (input_format, output_format, input_path, load, max_output_size)
+        for output_format in output_formats
+    ]
+
+    processes = process_budget(load, len(args))
+    if processes > 1:
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+            # Sampled in the forked processes, so profiles show the conversions
+            sampled = list(executor.map(partial(sample_forked, _run_shared), *zip(*args)))
+        results = []
+        for result, samples in sampled:
+            merge_samples(samples)
+            results.append(result)
+    else:
+        results = [_run_shared(*arg) for arg in args]
+    return dict(zip(output_formats, results))
+
+def _worker_error(error_type: str, message: str) -> Exception:
+    """Rebuild an error reported by a worker process."""
+    if error_type in ('MemoryError', 'timeout'):
+        return JobLimitError(message)
+    return _WORKER_ERRORS.get(error_type, ConversionError)(message)
+
+def _stop_process(process: multiprocessing.Process) -> None:
+    """Kill a worker process and everything it forked."""
+    if process.is_alive():
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (AttributeError, OSError):
+            # No process groups, or the worker has not created its own yet
+            process.kill()
+
+def _signal_process(process: multiprocessing.Process, signum: int) -> None:
+    """Send a signal to a worker process and everything it forked."""
+    if process.is_alive():
+        try:
+            os.killpg(process.pid, signum)
+        except OSError:
+            # The worker has not created its own process group yet
+            os.kill(process.pid, signum)
+
+async def _dump_profile(process: multiprocessing.Process, profile_dir: str) -> Optional[str]:
+    """Collect the profile of a worker that is about to be killed."""
+    if _DUMP_SIGNAL is None:
+        return None
+    _signal_process(process, _DUMP_SIGNAL)
+    deadline = time.monotonic() + PROFILE_DUMP_WAIT
+    while (not os.path.exists(dump_path(profile_dir, process.pid))
+           and process.is_alive() and time.monotonic() < deadline):
+        await asyncio.sleep(POLL_INTERVAL)
+    # Processes forked by the worker write theirs at the same time
+    await asyncio.sleep(POLL_INTERVAL)
+    return read_dumps(profile_dir) or None
+
+def _warm_up() -> None:
+    """No-op worker used to wait until the fork server is ready."""
+
+def _apply_limits(memory_limit: int, cpu_limit: int) -> None:
+    """Apply address space and CPU time rlimits to the current process."""
+    if resource is None:
+        return
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    if cpu_limit:
+        # The soft limit delivers SIGXCPU, the hard limit SIGKILL
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 5))
+
+def _worker_main(conn, func: Callable, args: tuple, work_dir: str,
+                 memory_limit: int, cpu_limit: int, profile_after: Optional[float],
+                 profile_dir: Optional[str]) -> None:
+    """
+    Entry point of a worker process: run one conversion and report back.
+
+    Sends the result together with a folded stack profile if profiling is on
+    (profile_after is not None) and the conversion took at least
+    profile_after seconds. A worker about to be killed for taking too long
+    writes its profile to profile_dir when signalled instead.
+    """
+    try:
+        _run_job(conn, func, args, work_dir, memory_limit, cpu_limit, profile_after, profile_dir)
+    except MemoryError:
+        # Out of memory outside the conversion, e.g. while building or
+        # sending the report; the exit code still marks it as a limit hit
+        os._exit(_EXIT_OUT_OF_MEMORY)
+
+def _run_job(conn, func: Callable, args: tuple, work_dir: str,
+             memory_limit: int, cpu_limit: int, profile_after: Optional[float],
+             profile_dir: Optional[str]) -> None:
+    sampler = StackSampler() if profile_after is not None else nullcontext()
+    started = time.monotonic()
+    try:
+        if hasattr(os, 'setpgrp'):
+            # Own process group, so a cancel also kills processes forked by the job
+            os.setpgrp()
+        _apply_limits(memory_limit, cpu_limit)
+        if profile_dir is not None and _DUMP_SIGNAL is not None:
+            dump_on_signal(_DUMP_SIGNAL, profile_dir)
+        # Keep every temporary file of the converters inside the job directory
+        tempfile.tempdir = work_dir
+        with sampler:
+            result = ('ok', func(*args))
+    except MemoryError:
+        result = ('error', 'MemoryError', 'Memory limit exceeded')
+    except Exception as e:
+        result = ('error', type(e).__name__, str(e))
+
+    profile = None
+    if profile_after is not None and time.monotonic() - started >= profile_after:
+        profile = sampler.folded()
+
+    conn.send((result, profile))
+    conn.close()
+
+class ConversionJob:
+    """
+    A conversion job for one user in a chat, with its own working directory.
+    A batch job may run several worker processes at once.
+    """
+
+    def __init__(self, pool: 'WorkerPool', chat_id: int, user_id: Optional[int] = None):
+        self.pool = pool
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.work_dir = os.path.join(pool.temp_dir, f'job-{uuid.uuid4().hex}')
+        self.cancelled = False
+        self.interrupted = False
+        self._processes: Set[multiprocessing.Process] = set()
+
+    def __enter__(self) -> 'ConversionJob':
+        if self.pool.draining:
+            # Shutting down: new jobs are checkpointed instead of started
+            raise JobInterruptedError("Bot is shutting down")
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.pool.register(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop_processes()
+        self.pool.unregister(self)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def path_for(self, file_name: str) -> str:
+        """Return a path for a file inside the job directory."""
+        return os.path.join(self.work_dir, os.path.basename(file_name))
+
+    def cancel(self) -> None:
+        """Cancel the job, killing its worker processes if they are running."""
+        self.cancelled = True
+        self._stop_processes()
+
+    def interrupt(self) -> None:
+        """Stop the job because the bot is shutting down."""
+        self.interrupted = True
+        self.cancel()
+
+    def _check_cancelled(self) -> None:
+        if self.interrupted:
+            raise JobInterruptedError("Job interrupted by shutdown")
+        if self.cancelled:
+            raise JobCancelledError("Job cancelled")
+
+    def _stop_processes(self) -> None:
+        for process in list(self._processes):
+            _stop_process(process)
+
+    async def run(self, input_format: str, output_format: str, input_path: str) -> str:
+        """Convert a file in a worker process and return the output path."""
+        return await self._execute(run_converter, input_format, output_format, input_path)
+
+    async def run_many(self, input_format: str, output_formats: List[str],
+                       input_path: str) -> Dict[str, Union[str, Exception]]:
+        """
+        Convert a file to several formats in a worker process.
+        Returns the output path per format, or the error if that format failed.
+        """
+        results = await self._execute(run_converters, input_format, output_formats, input_path)
+        return {
+            output_format: result[1] if result[0] == 'ok' else _worker_error(*result[1:])
+            for output_format, result in results.items()
+        }
+
+    async def _execute(self, func: Callable, *args) -> Any:
+        """Run func(*args, load, max_output_size) in a worker process once a slot is free."""
+        async with self.pool.slots:
+            self._check_cancelled()
+
+            profile_after = self.pool.profile_after()
+            profile_dir = None
+            if profile_after is not None:
+                profile_dir = tempfile.mkdtemp(prefix='profile-', dir=self.work_dir)
+
+            ctx = self.pool.context
+            receiver, sender = ctx.Pipe(duplex=False)
+            process = ctx.Process(
+                target=_worker_main,
+                args=(sender, func, args + (self.pool.load(), self.pool.max_output_size),
+                      self.work_dir, self.pool.memory_limit, self.pool.cpu_limit,
+                      profile_after, profile_dir)
+            )
+            started = time.monotonic()
+            process.start()
+            self._processes.add(process)
+            sender.close()
+
+            try:
+                result, profile = await self._wait_for_result(process, receiver, started, profile_dir)
+            finally:
+                receiver.close()
+                _stop_process(process)
+                process.join()
+                self._processes.discard(process)
+                if profile_dir is not None:
+                    shutil.rmtree(profile_dir, ignore_errors=True)
+
+        if profile:
+            self.pool.record_profile(self.chat_id, args, result, time.monotonic() - started, profile)
+
+        if result[0] == 'ok':
+            return result[1]
+        raise _worker_error(*result[1:])
+
+    async def _wait_for_result(self, process: multiprocessing.Process, receiver,
+                               started: float, profile_dir: Optional[str]) -> tuple:
+        while True:
+            self._check_cancelled()
+
+            if receiver.poll():
+                try:
+                    return receiver.recv()
+                except EOFError:
+                    # The worker died before reporting back
+                    process.join()
+                    exitcode = process.exitcode
+                    if exitcode in (_EXIT_OUT_OF_MEMORY, -signal.SIGKILL,
+                                    -getattr(signal, 'SIGXCPU', signal.SIGKILL)):
+                        raise JobLimitError(f"Worker killed by resource limits (exit code {exitcode})")
+                    raise ConversionError(f"Worker exited unexpectedly (exit code {exitcode})")
+
+            if time.monotonic() - started > self.pool.timeout:
+                logger.warning(f"Job for chat {self.chat_id} timed out after {self.pool.timeout}s")
+                profile = None
+                if profile_dir is not None:
+                    profile = await _dump_profile(process, profile_dir)
+                return ('error', 'timeout', 'Job timed out'), profile
+
+            await asyncio.sleep(POLL_INTERVAL)
+
+class WorkerPool:
+    """Bounded set of conversion worker processes with per-job limits."""
+
+    def __init__(self, temp_dir: str, max_jobs: int, timeout: float,
+                 memory_limit: int = 0, cpu_limit: int = 0, max_output_size: int = 0,
+                 profile_threshold: float = 0, profile_ring_size: int = 20):
+        self.temp_dir = temp_dir
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        # Largest output the bot can send, passed to the converters (0: no limit)
+        self.max_output_size = max_output_size
+        # Jobs slower than profile_threshold seconds keep their profile (0: never).
+        # profile_all keeps the profile of every job.
+        self.profile_threshold = profile_threshold
+        self.profile_all = False
+        self.profiles: Deque[Dict[str, Any]] = deque(maxlen=profile_ring_size)
+        self.context = multiprocessing.get_context()
+        self.slots = asyncio.Semaphore(max_jobs)
+        # Active jobs per chat; a group chat can have one per user
+        self.jobs: Dict[int, Set[ConversionJob]] = {}
+        self.draining = False
+
+    def start(self) -> float:
+        """
+        Start the fork server that workers are forked from.
+
+        The fork server imports the converter libraries once, so workers
+        start with them already loaded instead of importing them per job.
+        Falls back to the default start method where fork servers are not
+        available. Returns the time in seconds until workers were ready.
+        """
+        started = time.perf_counter()
+
+        # Job directories left behind by a previous run that did not exit cleanly
+        if os.path.isdir(self.temp_dir):
+            for name in os.listdir(self.temp_dir):
+                if name.startswith('job-'):
+                    shutil.rmtree(os.path.join(self.temp_dir, name), ignore_errors=True)
+
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self.context = multiprocessing.get_context('forkserver')
+            self.context.set_forkserver_preload(PRELOAD_MODULES)
+
+        # Forking one worker waits for the fork server to finish preloading
+        process = self.context.Process(target=_warm_up, daemon=True)
+        process.start()
+        process.join()
+        return time.perf_counter() - started
+
+    def job(self, chat_id: int, user_id: Optional[int] = None) -> ConversionJob:
+        """Create a new job for a user in a chat."""
+        return ConversionJob(self, chat_id, user_id)
+
+    def register(self, job: ConversionJob) -> None:
+        self.jobs.setdefault(job.chat_id, set()).add(job)
+
+    def unregister(self, job: ConversionJob) -> None:
+        jobs = self.jobs.get(job.chat_id)
+        if jobs is not None:
+            jobs.discard(job)
+            if not jobs:
+                del self.jobs[job.chat_id]
+
+    def active_jobs(self) -> List[ConversionJob]:
+        """All active jobs of all chats."""
+        return [job for jobs in self.jobs.values() for job in jobs]
+
+    def profile_after(self) -> Optional[float]:
+        """Minimum duration of a job whose profile is kept, None to not profile."""
+        if self.profile_all:
+            return 0.0
+        return self.profile_threshold or None
+
+    def record_profile(self, chat_id: int, args: tuple, result: tuple,
+                       duration: float, profile: str) -> None:
+        """Keep the profile of a job, dropping the oldest one if the ring is full."""
+        input_format, output_formats, input_path = args
+        if isinstance(output_formats, str):
+            output_formats = [output_formats]
+        try:
+            file_size = os.path.getsize(input_path)
+        except OSError:
+            file_size = 0
+        self.profiles.appendleft({
+            'chat_id': chat_id,
+            'input_format': input_format,
+            'output_formats': list(output_formats),
+            'file_name': os.path.basename(input_path),
+            'file_size': file_size,
+            'duration': duration,
+            'status': 'ok' if result[0] == 'ok' else result[1],
+            'finished': time.time(),
+            'folded': profile
+        })
+        logger.info(f"Captured profile of a {duration:.1f}s job for chat {chat_id}")
+
+    def load(self) -> float:
+        """Other active jobs (running, queued or downloading) per worker slot, as seen by one job."""
+        return max(len(self.active_jobs()) - 1, 0) / self.max_jobs
+
+    @staticmethod
+    def heavy_modules_loaded() -> List[str]:
+        """Return the worker-only libraries imported by this process."""
+        return [name for name in HEAVY_MODULES if name in sys.modules]
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Wait for running jobs to finish before a shutdown.
+
+        Jobs still running after the timeout are interrupted. Returns the
+        number of interrupted jobs.
+        """
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        while self.jobs and time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+
+        return self.interrupt_all()
+
+    def interrupt_all(self) -> int:
+        """Interrupt all running jobs. Returns the number of interrupted jobs."""
+        jobs = self.active_jobs()
+        for job in jobs:
+            job.interrupt()
+        return len(jobs)
+
+    def cancel(self, chat_id: int, user_id: Optional[int] = None) -> bool:
+        """
+        Cancel the active jobs of a user in a chat, or of every user if
+        user_id is None. Returns False if there are none.
+        """
+        jobs = [
+            job for job in self.jobs.get(chat_id, ())
+            if user_id is None or job.user_id == user_id
+        ]
+        for job in jobs:
+            job.cancel()
+        return bool(jobs)